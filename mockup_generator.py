@@ -5,6 +5,8 @@ import zipfile
 import io
 import cv2
 import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 st.set_page_config(page_title="Shirt Mockup Generator", layout="centered")
 st.title("👕 Shirt Mockup Generator with Batching")
@@ -69,32 +71,52 @@ if design_files:
 
 # --- Bounding Box Detection ---
 def get_shirt_bbox(pil_image):
-    img_cv = np.array(pil_image.convert("RGB"))[:, :, ::-1]
-    gray = cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    _, thresh = cv2.threshold(blurred, 240, 255, cv2.THRESH_BINARY_INV)
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    if contours:
-        largest = max(contours, key=cv2.contourArea)
-        return cv2.boundingRect(largest)
-    return None
+    arr = np.asarray(pil_image)
+    code = cv2.COLOR_RGBA2GRAY if arr.shape[2] == 4 else cv2.COLOR_RGB2GRAY
+    gray = cv2.cvtColor(arr, code)
+    mask = gray < 240  # anything not near-white is shirt
+    if not mask.any():
+        return None
+    rows = np.where(mask.any(axis=1))[0]
+    cols = np.where(mask.any(axis=0))[0]
+    return (cols[0], rows[0], cols[-1] - cols[0] + 1, rows[-1] - rows[0] + 1)
 
 # --- Skew Helper Function ---
 def apply_skew(image, skew_x_deg=0, skew_y_deg=0):
-    width, height = image.size
     skew_x = np.tan(np.radians(skew_x_deg))
     skew_y = np.tan(np.radians(skew_y_deg))
 
-    matrix = (1, skew_x, 0,
-              skew_y, 1, 0)
+    if skew_x == 0 and skew_y == 0:
+        return image
 
-    return image.transform(
-        (width, height),
-        Image.AFFINE,
+    # Same output→input matrix PIL's Image.AFFINE used, so pass
+    # WARP_INVERSE_MAP to keep the skew direction identical
+    matrix = np.float32([[1, skew_x, 0],
+                         [skew_y, 1, 0]])
+
+    warped = cv2.warpAffine(
+        np.asarray(image),
         matrix,
-        resample=Image.BICUBIC,
-        fillcolor=(0, 0, 0, 0)
+        (image.width, image.height),
+        flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=(0, 0, 0, 0)
     )
+    return Image.fromarray(warped)
+
+# --- Batch Worker ---
+def render_one(task):
+    """Paste a pre-resized design onto a shirt template and encode the PNG.
+    Runs in a worker process; placement is precomputed by the main process."""
+    design, shirt_bytes, x, y, output_name = task
+
+    shirt = Image.open(io.BytesIO(shirt_bytes)).convert("RGBA")
+    shirt.paste(design, (x, y), design)
+
+    img_byte_arr = io.BytesIO()
+    # Light zlib level — the master zip deflates the entries again anyway
+    shirt.save(img_byte_arr, format='PNG', compress_level=1)
+    return output_name, img_byte_arr.getvalue()
 
 # --- Live Preview ---
 if design_files and shirt_files:
@@ -121,7 +143,7 @@ if design_files and shirt_files:
             scale = min(sw / design.width, sh / design.height, 1.0) * padding_ratio
             new_width = int(design.width * scale)
             new_height = int(design.height * scale)
-            resized_design = design.resize((new_width, new_height))
+            resized_design = design.resize((new_width, new_height), Image.LANCZOS)
 
             # ✅ Apply skew
             resized_design = apply_skew(resized_design, skew_x_deg, skew_y_deg)
@@ -146,59 +168,88 @@ if st.button("🚀 Generate Mockups for Selected Batch"):
     if not (selected_batch and shirt_files):
         st.warning("Upload at least one design and one shirt template.")
     else:
-        master_zip = io.BytesIO()
-        with zipfile.ZipFile(master_zip, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for design_file in selected_batch:
-                graphic_name = st.session_state.design_names.get(design_file.name, "graphic")
-                design_file.seek(0)
-                design = Image.open(design_file).convert("RGBA")
-
-                for shirt_file in shirt_files:
-                    color_name = os.path.splitext(shirt_file.name)[0]
-                    shirt_file.seek(0)
-                    shirt = Image.open(shirt_file).convert("RGBA")
-
-                    is_model = "model" in shirt_file.name.lower()
-                    offset_pct = model_offset_pct if is_model else plain_offset_pct
-                    padding_ratio = model_padding_ratio if is_model else plain_padding_ratio
-                    x_offset_pct = model_horizontal_offset_pct if is_model else plain_horizontal_offset_pct
-                    skew_x_deg = model_skew_x if is_model else plain_skew_x
-                    skew_y_deg = model_skew_y if is_model else plain_skew_y
-
-                    bbox = get_shirt_bbox(shirt)
-                    if bbox:
-                        sx, sy, sw, sh = bbox
-                        scale = min(sw / design.width, sh / design.height, 1.0) * padding_ratio
-                        new_width = int(design.width * scale)
-                        new_height = int(design.height * scale)
-                        resized_design = design.resize((new_width, new_height))
-
-                        # ✅ Apply skew before placement
-                        resized_design = apply_skew(resized_design, skew_x_deg, skew_y_deg)
-
-                        y_offset = int(sh * offset_pct / 100)
-                        x_offset = int(sw * x_offset_pct / 100)
-                        x = sx + (sw - new_width) // 2 + x_offset
-                        y = sy + y_offset
-                    else:
-                        resized_design = design
-                        x = (shirt.width - design.width) // 2
-                        y = (shirt.height - design.height) // 2
-
-                    shirt_copy = shirt.copy()
-                    shirt_copy.paste(resized_design, (x, y), resized_design)
-
-                    # Save directly into master ZIP
-                    output_name = f"{graphic_name}_{color_name}_tee.png"
-                    img_byte_arr = io.BytesIO()
-                    shirt_copy.save(img_byte_arr, format='PNG')
-                    img_byte_arr.seek(0)
-                    zipf.writestr(output_name, img_byte_arr.getvalue())
-
-        master_zip.seek(0)
+        # ✅ Shirt-derived data doesn't depend on the design, so decode each
+        # template and detect its bounding box once instead of once per pair
+        shirt_cache = {}
+        for shirt_file in shirt_files:
+            shirt_bytes = shirt_file.getvalue()
+            shirt = Image.open(io.BytesIO(shirt_bytes)).convert("RGBA")
+            is_model = "model" in shirt_file.name.lower()
+            shirt_cache[shirt_file.name] = {
+                "bytes": shirt_bytes,
+                "bbox": get_shirt_bbox(shirt),
+                "size": shirt.size,
+                "offset_pct": model_offset_pct if is_model else plain_offset_pct,
+                "padding_ratio": model_padding_ratio if is_model else plain_padding_ratio,
+                "x_offset_pct": model_horizontal_offset_pct if is_model else plain_horizontal_offset_pct,
+                "skew_x_deg": model_skew_x if is_model else plain_skew_x,
+                "skew_y_deg": model_skew_y if is_model else plain_skew_y,
+            }
+
+        # ✅ Each (design, shirt) pair is independent — build the task list
+        # and fan it out across CPU cores
+        tasks = []
+        for design_file in selected_batch:
+            graphic_name = st.session_state.design_names.get(design_file.name, "graphic")
+            design_file.seek(0)
+            design = Image.open(design_file).convert("RGBA")
+
+            # ✅ Shirts of the same type share bbox-derived sizes, so cache
+            # the resized + skewed design per (size, skew) key
+            resized_cache = {}
+
+            for shirt_file in shirt_files:
+                color_name = os.path.splitext(shirt_file.name)[0]
+                cached = shirt_cache[shirt_file.name]
+
+                offset_pct = cached["offset_pct"]
+                padding_ratio = cached["padding_ratio"]
+                x_offset_pct = cached["x_offset_pct"]
+                skew_x_deg = cached["skew_x_deg"]
+                skew_y_deg = cached["skew_y_deg"]
+
+                bbox = cached["bbox"]
+                if bbox:
+                    sx, sy, sw, sh = bbox
+                    scale = min(sw / design.width, sh / design.height, 1.0) * padding_ratio
+                    new_width = int(design.width * scale)
+                    new_height = int(design.height * scale)
+
+                    key = (new_width, new_height, skew_x_deg, skew_y_deg)
+                    if key not in resized_cache:
+                        resized_cache[key] = apply_skew(
+                            design.resize((new_width, new_height), Image.LANCZOS),
+                            skew_x_deg, skew_y_deg
+                        )
+                    resized_design = resized_cache[key]
+
+                    y_offset = int(sh * offset_pct / 100)
+                    x_offset = int(sw * x_offset_pct / 100)
+                    x = sx + (sw - new_width) // 2 + x_offset
+                    y = sy + y_offset
+                else:
+                    resized_design = design
+                    x = (cached["size"][0] - design.width) // 2
+                    y = (cached["size"][1] - design.height) // 2
+
+                output_name = f"{graphic_name}_{color_name}_tee.png"
+                tasks.append((resized_design, cached["bytes"], x, y, output_name))
+
+        cpus = os.cpu_count() or 1
+        # ✅ Spool the archive to disk through a 4 MiB write buffer instead
+        # of holding every PNG in RAM until the user downloads
+        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".zip")
+        tmp.close()
+        with open(tmp.name, "wb", buffering=4 << 20) as zip_out:
+            with zipfile.ZipFile(zip_out, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as zipf:
+                with ProcessPoolExecutor(max_workers=cpus) as executor:
+                    chunksize = max(1, len(tasks) // (4 * cpus))
+                    for output_name, png_bytes in executor.map(render_one, tasks, chunksize=chunksize):
+                        zipf.writestr(output_name, png_bytes)
+
         st.download_button(
             label="📦 Download All Mockups",
-            data=master_zip,
+            data=open(tmp.name, "rb"),
             file_name="all_mockups.zip",
             mime="application/zip"
         )